@@ -7,7 +7,7 @@ from torch.amp import autocast
 import pandas as pd
 
 
-def generate_classification_report(model, test_loader, device, classes=['neg', 'pos']):
+def generate_classification_report(model, test_loader, device, classes=['neg', 'pos'], batch_transform=None):
     model.eval()
     all_labels = []
     all_preds = []
@@ -17,6 +17,8 @@ def generate_classification_report(model, test_loader, device, classes=['neg', '
             inputs = inputs.to(device, non_blocking=True)
             masks = masks.to(device, non_blocking=True)
             labels = labels.to(device, non_blocking=True)
+            if batch_transform is not None:
+                inputs = batch_transform(inputs)
 
             if "cuda" in device.type:
                 with autocast(device.type):
@@ -40,7 +42,7 @@ def generate_classification_report(model, test_loader, device, classes=['neg', '
     plt.show()
 
 
-def generate_detailed_classification_report(model, test_loader, device, classes=['Alert', 'Drowsy']):
+def generate_detailed_classification_report(model, test_loader, device, classes=['Alert', 'Drowsy'], batch_transform=None):
     """
     Generates and visualizes a detailed classification report for a given model on the test dataset.
     
@@ -52,6 +54,8 @@ def generate_detailed_classification_report(model, test_loader, device, classes=
         test_loader (torch.utils.data.DataLoader): DataLoader for the test dataset.
         device (torch.device): Device to perform computations on ('cpu' or 'cuda').
         classes (list of str, optional): List of class names. Defaults to ['Alert', 'Drowsy'].
+        batch_transform (callable, optional): Transform applied to each input batch after it is moved
+            to the device (e.g. gpu_preprocess for datasets built with gpu_transform=True).
     """
     
     # Set the model to evaluation mode
@@ -73,6 +77,8 @@ def generate_detailed_classification_report(model, test_loader, device, classes=
             inputs = inputs.to(device, non_blocking=True)
             masks = masks.to(device, non_blocking=True)
             labels = labels.to(device, non_blocking=True)
+            if batch_transform is not None:
+                inputs = batch_transform(inputs)
             
             # Perform mixed-precision inference if using CUDA for efficiency
             if device.type == "cuda":
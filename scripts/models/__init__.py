@@ -0,0 +1,25 @@
+import torch
+
+
+def enable_tf32():
+    """
+    Enables TF32 matmuls/convolutions and cuDNN benchmarking.
+
+    These are global backend settings, so they affect every model in the process.
+    """
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+
+def compile_in_place(*modules):
+    """
+    Compiles modules with torch.compile (mode='max-autotune', dynamic=False).
+
+    Modules are compiled in place so parameter names (and therefore checkpoints) are unchanged.
+    Input shapes should stay fixed to avoid recompilation.
+
+    Args:
+        *modules (nn.Module): Modules to compile.
+    """
+    for module in modules:
+        module.compile(mode='max-autotune', dynamic=False)
@@ -1,8 +1,9 @@
 import torch
 import torch.nn as nn
-from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+from torch.nn.utils.rnn import pack_padded_sequence
 from timm import create_model
 import torch.nn.functional as F
+from . import enable_tf32, compile_in_place
 
 
 class VisionTransformerLSTMv1(nn.Module):
@@ -15,7 +16,9 @@ class VisionTransformerLSTMv1(nn.Module):
         dropout_p=0.5,
         rnn_num_layers=1,
         bidirectional=False,
-        freeze_vit=False
+        freeze_vit=False,
+        compile_vit=False,
+        allow_tf32=False
     ):
         """
         Initializes the VisionTransformer model with optional temporal modeling and sequence-level masking.
@@ -28,6 +31,11 @@ class VisionTransformerLSTMv1(nn.Module):
             rnn_num_layers (int, optional): Number of LSTM layers. Defaults to 1.
             bidirectional (bool, optional): Whether the LSTM is bidirectional. Defaults to False.
             freeze_vit (bool, optional): Whether to freeze ViT parameters. Defaults to False.
+            compile_vit (bool, optional): Whether to compile the ViT backbone with torch.compile
+                                          (mode='max-autotune', dynamic=False). Input shapes should stay
+                                          fixed to avoid recompilation. Defaults to False.
+            allow_tf32 (bool, optional): Whether to enable TF32 matmuls/convolutions and cuDNN benchmarking
+                                         (global backend settings). Defaults to False.
         """
         super(VisionTransformerLSTMv1, self).__init__()
         
@@ -48,6 +56,7 @@ class VisionTransformerLSTMv1(nn.Module):
         
         # Replace the classification head with an identity function to extract features
         self.vit.head = nn.Identity()
+        self.vit_cpu_only = False  # Set once the backbone is dynamically quantized (see quantize_vit)
         
         self.use_temporal_model = use_temporal_modeling
         if self.use_temporal_model:
@@ -71,6 +80,36 @@ class VisionTransformerLSTMv1(nn.Module):
                 nn.Dropout(p=dropout_p),
                 nn.Linear(in_features, num_classes)
             )
+        
+        if allow_tf32:
+            enable_tf32()
+        
+        if compile_vit:
+            compile_in_place(self.vit)
+    
+    def quantize_vit(self):
+        """
+        Quantizes the Linear layers of the frozen ViT backbone to int8 for inference.
+        
+        The quantization backend follows the model's current device, so load any fp32 checkpoint
+        and move the model first: ``model.to(device); model.quantize_vit()``. On a GPU this uses
+        torchao's int8 weight-only quantization (torchao required). On the CPU it uses PyTorch's
+        dynamic int8 quantization, whose kernels are CPU only, and the model can no longer run on
+        CUDA afterwards. The classification heads are outside the backbone and stay in floating point.
+        
+        Raises:
+            RuntimeError: If the model is on a GPU and torchao is not installed
+        """
+        device = next(self.vit.parameters()).device
+        if device.type == 'cuda':
+            try:
+                from torchao.quantization import quantize_, int8_weight_only
+            except ImportError:
+                raise RuntimeError("GPU quantization requires torchao; install it or quantize on the CPU.")
+            quantize_(self.vit, int8_weight_only())
+        else:
+            self.vit = torch.ao.quantization.quantize_dynamic(self.vit, {nn.Linear}, dtype=torch.qint8)
+            self.vit_cpu_only = True
     
     def forward(self, x, img_mask=None, seq_mask=None):
         """
@@ -85,6 +124,9 @@ class VisionTransformerLSTMv1(nn.Module):
         """
         # Ensure input has the correct dimensions
         assert x.dim() == 5, f"Expected 5D input, got {x.dim()}D input."
+        if self.vit_cpu_only and x.device.type != 'cpu':
+            raise RuntimeError("The ViT backbone was quantized on the CPU and only runs on CPU inputs; "
+                               "call model.to(device) before model.quantize_vit().")
 
         batch_size, num_frames, c, h, w = x.size()
 
@@ -101,62 +143,39 @@ class VisionTransformerLSTMv1(nn.Module):
         if self.use_temporal_model:
             # Handle temporal modeling with LSTM
             if seq_mask is None:
-                # If no mask is provided, assume all frames are valid
-                lengths = torch.full((batch_size,), num_frames, dtype=torch.long, device=x.device)
+                # If no mask is provided, all frames are valid and no packing is needed
+                _, (hn, _) = self.temporal_model(x)
             else:
-                # Compute actual lengths from the mask
-                lengths = seq_mask.sum(dim=1).long()  # Shape: [batch_size]
+                # Compute actual lengths from the mask (at least 1 for packing)
+                lengths = seq_mask.sum(dim=1).long().clamp(min=1)  # Shape: [batch_size]
 
-            # Sort the batch by lengths in descending order (required by pack_padded_sequence)
-            lengths_sorted, sorted_idx = lengths.sort(descending=True)
-            x_sorted = x[sorted_idx]
-
-            # Pack the sequences for efficient processing
-            packed_input = pack_padded_sequence(
-                x_sorted, 
-                lengths_sorted.cpu(), 
-                batch_first=True, 
-                enforce_sorted=True
-            )
-
-            # Pass through LSTM
-            packed_output, (hn, cn) = self.temporal_model(packed_input)
-
-            # Unpack the sequences
-            output, _ = pad_packed_sequence(
-                packed_output, 
-                batch_first=True, 
-                total_length=num_frames
-            )
+                # Pack the sequences without sorting; hn is returned in the original batch order
+                packed_input = pack_padded_sequence(
+                    x, 
+                    lengths.cpu(), 
+                    batch_first=True, 
+                    enforce_sorted=False
+                )
 
-            # Restore the original order of the batch
-            _, original_idx = sorted_idx.sort()
-            output = output[original_idx]
+                # Pass through LSTM
+                _, (hn, _) = self.temporal_model(packed_input)
 
-            if seq_mask is not None:
-                # Ensure lengths are at least 1 to avoid negative indexing
-                lengths = lengths.clamp(min=1)
-                # Gather the last valid output for each sequence
-                last_indices = (lengths - 1).view(batch_size, 1, 1).expand(-1, 1, output.size(2))
-                last_outputs = output.gather(1, last_indices).squeeze(1)  # Shape: [batch_size, hidden_size]
+            # The final hidden state already holds the last valid output of each sequence
+            if self.temporal_model.bidirectional:
+                last_outputs = torch.cat([hn[-2], hn[-1]], dim=-1)  # Shape: [batch_size, 2 * hidden_size]
             else:
-                # If no mask, take the last time step
-                last_outputs = output[:, -1, :]  # Shape: [batch_size, hidden_size]
+                last_outputs = hn[-1]  # Shape: [batch_size, hidden_size]
 
             # Pass through the temporal fully connected layer to get logits
             x = self.temporal_fc(last_outputs)  # Shape: [batch_size, num_classes]
         else:
             # Handle simple feature aggregation without temporal modeling
             if seq_mask is not None:
-                # Expand mask to match feature dimensions
-                mask_expanded = seq_mask.unsqueeze(-1).float()  # Shape: [batch_size, num_frames, 1]
-                # Zero out features of padded frames
-                x = x * mask_expanded
-                # Sum the features over valid frames
-                sum_features = x.sum(dim=1)  # Shape: [batch_size, feature_dim]
+                m = seq_mask.to(x.dtype)  # Shape: [batch_size, num_frames]
+                # Sum the features over valid frames in a single contraction (no masked copy of x)
+                sum_features = torch.einsum('btd,bt->bd', x, m)  # Shape: [batch_size, feature_dim]
                 # Count the number of valid frames
-                counts = mask_expanded.sum(dim=1)  # Shape: [batch_size, 1]
-                counts = counts.clamp(min=1)  # Avoid division by zero
+                counts = m.sum(1, keepdim=True).clamp_(min=1)  # Avoid division by zero
                 # Compute the mean over valid frames
                 x = sum_features / counts
             else:
@@ -330,36 +349,29 @@ class VisionTransformerLSTM(nn.Module):
         if self.use_temporal_model:
             # Handle sequence masking
             if seq_mask is not None:
-                lengths = seq_mask.sum(dim=1).long()
-                lengths_sorted, sorted_idx = lengths.sort(descending=True)
-                features_sorted = features[sorted_idx]
+                lengths = seq_mask.sum(dim=1).long().clamp(min=1)
                 
                 packed_input = pack_padded_sequence(
-                    features_sorted,
-                    lengths_sorted.cpu(),
+                    features,
+                    lengths.cpu(),
                     batch_first=True,
-                    enforce_sorted=True
+                    enforce_sorted=False
                 )
                 
-                packed_output, _ = self.lstm(packed_input)
-                output, _ = pad_packed_sequence(packed_output, batch_first=True, total_length=num_frames)
-                
-                _, original_idx = sorted_idx.sort()
-                output = output[original_idx]
-                
-                lengths = lengths.clamp(min=1)
-                last_indices = (lengths - 1).view(batch_size, 1, 1).expand(-1, 1, output.size(2))
-                last_outputs = output.gather(1, last_indices).squeeze(1)
+                _, (hn, _) = self.lstm(packed_input)
+            else:
+                _, (hn, _) = self.lstm(features)
+            
+            if self.lstm.bidirectional:
+                last_outputs = torch.cat([hn[-2], hn[-1]], dim=-1)
             else:
-                output, _ = self.lstm(features)
-                last_outputs = output[:, -1, :]
+                last_outputs = hn[-1]
             
             logits = self.classifier(last_outputs)
         else:
             if seq_mask is not None:
-                mask_expanded = seq_mask.unsqueeze(-1).float()
-                features = features * mask_expanded
-                aggregated = features.sum(dim=1) / mask_expanded.sum(dim=1).clamp(min=1)
+                m = seq_mask.to(features.dtype)
+                aggregated = torch.einsum('btd,bt->bd', features, m) / m.sum(1, keepdim=True).clamp_(min=1)
             else:
                 aggregated = features.mean(dim=1)
             
@@ -1,10 +1,60 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
+import os
+import contextlib
+from . import enable_tf32, compile_in_place
+
+# FlexAttention is only public from PyTorch 2.5
+try:
+    from torch.nn.attention.flex_attention import create_block_mask, flex_attention
+except ImportError:
+    create_block_mask = flex_attention = None
+
+# Apex's fused LayerNorm is optional
+try:
+    from apex.normalization import FusedLayerNorm
+except ImportError:
+    FusedLayerNorm = None
+
+# Compiled FlexAttention kernel, shared by all attention modules and built on first use
+_compiled_flex_attention = None
+
+
+def _get_flex_attention():
+    """
+    Returns the compiled FlexAttention kernel, compiling it on first use.
+    """
+    global _compiled_flex_attention
+    if _compiled_flex_attention is None:
+        _compiled_flex_attention = torch.compile(flex_attention, dynamic=False)
+    return _compiled_flex_attention
+
+
+def _make_norm(norm_type, embed_dim):
+    """
+    Builds the normalization layer used inside the encoder layers.
+    
+    Args:
+        norm_type (str): 'layernorm', 'fused_layernorm' (apex FusedLayerNorm, falling back to nn.LayerNorm
+                         when apex is not installed) or 'rmsnorm'.
+        embed_dim (int): Dimension of the embeddings.
+    
+    Returns:
+        nn.Module: The normalization layer.
+    """
+    if norm_type == 'layernorm':
+        return nn.LayerNorm(embed_dim)
+    if norm_type == 'fused_layernorm':
+        return FusedLayerNorm(embed_dim) if FusedLayerNorm is not None else nn.LayerNorm(embed_dim)
+    if norm_type == 'rmsnorm':
+        return nn.RMSNorm(embed_dim)
+    raise ValueError(f"Unsupported norm_type '{norm_type}'. Choose from 'layernorm', 'fused_layernorm', 'rmsnorm'.")
 
 
 class PatchEmbedding(nn.Module):
-    def __init__(self, img_size=224, patch_size=16, in_channels=3, embed_dim=768):
+    def __init__(self, img_size=224, patch_size=16, in_channels=3, embed_dim=768, num_tokens=0, channels_last=False):
         """
         Initializes the Patch Embedding module.
         
@@ -13,6 +63,12 @@ class PatchEmbedding(nn.Module):
             patch_size (int): Size of each patch (assumed square).
             in_channels (int): Number of input channels (e.g., 3 for RGB).
             embed_dim (int): Dimension of the embedding space.
+            num_tokens (int, optional): Number of leading token slots (e.g., a class token) to reserve
+                                        in the output. They are left uninitialized for the caller to fill.
+                                        Defaults to 0.
+            channels_last (bool, optional): Whether to run the patch projection in channels_last (NHWC)
+                                            memory format, which selects cuDNN's faster NHWC kernels under
+                                            fp16/bf16. Defaults to False.
         """
         super(PatchEmbedding, self).__init__()
         
@@ -20,6 +76,8 @@ class PatchEmbedding(nn.Module):
         self.img_size = img_size
         self.patch_size = patch_size
         self.num_patches = (img_size // patch_size) ** 2
+        self.num_tokens = num_tokens
+        self.channels_last = channels_last
         
         # Validate that img_size is divisible by patch_size
         if img_size % patch_size != 0:
@@ -32,6 +90,14 @@ class PatchEmbedding(nn.Module):
             kernel_size=patch_size, 
             stride=patch_size
         )
+        if self.channels_last:
+            self.proj = self.proj.to(memory_format=torch.channels_last)
+        
+        # Reusable token tensor for inference, grown to the largest batch seen. A plain attribute (not
+        # a buffer) so it is never moved, broadcast or saved. Turned off while a CUDA graph is
+        # captured so the graph owns its token tensor instead of pointing at this one
+        self._scratch = None
+        self.reuse_scratch = True
     
     def forward(self, x):
         """
@@ -41,7 +107,9 @@ class PatchEmbedding(nn.Module):
             x (torch.Tensor): Input tensor of shape [batch_size, in_channels, img_size, img_size]
         
         Returns:
-            torch.Tensor: Embedded patches of shape [batch_size, num_patches, embed_dim]
+            torch.Tensor: Embedded patches of shape [batch_size, num_tokens + num_patches, embed_dim].
+                When gradients are disabled and num_tokens > 0, this is a view of a buffer that is
+                reused by the next call.
         """
         # Validate input shape
         if x.ndim != 4 or x.shape[2] != self.img_size or x.shape[3] != self.img_size:
@@ -49,6 +117,9 @@ class PatchEmbedding(nn.Module):
                 f"Input tensor must have shape [batch_size, {self.proj.in_channels}, {self.img_size}, {self.img_size}], but got {x.shape}"
             )
         
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        
         # Apply Conv2d to project patches into embedding space
         x = self.proj(x)  # [batch_size, embed_dim, num_patches_root, num_patches_root]
         
@@ -57,16 +128,40 @@ class PatchEmbedding(nn.Module):
         
         # Transpose to reorder dimensions: [batch_size, num_patches, embed_dim]
         x = x.transpose(1, 2)
-        return x
+        if self.num_tokens == 0:
+            return x
+        
+        # Write patches after the reserved token slots instead of concatenating later
+        batch_size, num_patches, embed_dim = x.shape
+        if torch.is_grad_enabled() or not self.reuse_scratch:
+            # Autograd keeps the token tensor alive for backward, so it can't be shared across steps;
+            # release any inference scratch so it doesn't stay allocated during training
+            self._scratch = None
+            out = x.new_empty(batch_size, self.num_tokens + num_patches, embed_dim)
+        else:
+            # Inference tensors can't be updated in place outside inference_mode (and vice versa)
+            scratch = self._scratch
+            if (scratch is None or scratch.size(0) < batch_size
+                    or scratch.dtype != x.dtype or scratch.device != x.device
+                    or scratch.is_inference() != torch.is_inference_mode_enabled()):
+                scratch = x.new_empty(batch_size, self.num_tokens + num_patches, embed_dim)
+                self._scratch = scratch
+            out = scratch[:batch_size]
+        out[:, self.num_tokens:].copy_(x)
+        return out
 
 class PositionalEncoding(nn.Module):
-    def __init__(self, embed_dim, max_len=5000):
+    def __init__(self, embed_dim, max_len=5000, half_precision=False):
         """
         Initializes the Positional Encoding module.
         
         Args:
             embed_dim (int): Dimension of the embeddings.
             max_len (int, optional): Maximum length of the sequences. Defaults to 5000.
+            half_precision (bool, optional): Whether to add an fp16/bf16 copy of the encoding to half-precision
+                                             inputs, keeping the residual stream in half precision under
+                                             autocast. By default the fp32 encoding is added, which promotes
+                                             the result to fp32. Defaults to False.
         """
         super(PositionalEncoding, self).__init__()
         
@@ -74,22 +169,25 @@ class PositionalEncoding(nn.Module):
         if embed_dim % 2 != 0:
             raise ValueError(f"embed_dim ({embed_dim}) must be even for sinusoidal positional encoding.")
         
-        # Initialize positional encoding tensor
-        pe = torch.zeros(max_len, embed_dim)
-        
         # Compute position indices and divisors
         position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)  # Shape: [max_len, 1]
         div_term = torch.exp(torch.arange(0, embed_dim, 2).float() * (-math.log(10000.0) / embed_dim))
+        theta = position * div_term  # Shape: [max_len, embed_dim // 2]
         
-        # Populate positional encodings using sine and cosine
-        pe[:, 0::2] = torch.sin(position * div_term)  # Sine for even indices
-        pe[:, 1::2] = torch.cos(position * div_term)  # Cosine for odd indices
+        # Interleave sine (even indices) and cosine (odd indices) in a single contiguous write
+        pe = torch.stack((theta.sin(), theta.cos()), dim=-1).reshape(max_len, embed_dim)
         
         # Add a batch dimension
         pe = pe.unsqueeze(0)  # Shape: [1, max_len, embed_dim]
         
         # Register as buffer (non-trainable parameter)
         self.register_buffer('pe', pe)
+        
+        # Optional half-precision copies so additions under autocast don't upcast the activations
+        self.half_precision = half_precision
+        if half_precision:
+            self.register_buffer('pe_half', pe.to(torch.float16), persistent=False)
+            self.register_buffer('pe_bf16', pe.to(torch.bfloat16), persistent=False)
     
     def forward(self, x):
         """
@@ -101,16 +199,28 @@ class PositionalEncoding(nn.Module):
         Returns:
             torch.Tensor: Positional encoded embeddings.
         """
-        # Validate embedding dimension
-        if x.size(2) != self.pe.size(2):
-            raise ValueError(f"Input embedding dimension ({x.size(2)}) must match positional encoding dimension ({self.pe.size(2)}).")
-        
-        # Validate sequence length
-        if x.size(1) > self.pe.size(1):
-            raise ValueError(f"Input sequence length ({x.size(1)}) exceeds maximum length ({self.pe.size(1)}). Increase max_len during initialization.")
-        
-        # Add positional encoding
-        x = x + self.pe[:, :x.size(1), :]  # Broadcast addition
+        # Validation is skipped under `python -O` to keep the hot path to a single add
+        if __debug__:
+            # Validate embedding dimension
+            if x.size(2) != self.pe.size(2):
+                raise ValueError(f"Input embedding dimension ({x.size(2)}) must match positional encoding dimension ({self.pe.size(2)}).")
+            
+            # Validate sequence length
+            if x.size(1) > self.pe.size(1):
+                raise ValueError(f"Input sequence length ({x.size(1)}) exceeds maximum length ({self.pe.size(1)}). Increase max_len during initialization.")
+        
+        # Pick the encoding that matches the activation dtype if half precision is enabled
+        pe = self.pe
+        if self.half_precision:
+            if x.dtype == torch.float16:
+                pe = self.pe_half
+            elif x.dtype == torch.bfloat16:
+                pe = self.pe_bf16
+        
+        # Add positional encoding; when max_len is the exact sequence length (as in the ViT) no slice is needed
+        if x.size(1) != pe.size(1):
+            pe = pe[:, :x.size(1), :]
+        x = x + pe  # Broadcast addition
         return x
     
 class ClassToken(nn.Module):
@@ -148,9 +258,11 @@ class ClassToken(nn.Module):
         # Expand the class token to match batch size
         cls_tokens = self.cls_token.expand(batch_size, -1, -1)  # [batch_size, 1, embed_dim]
         
-        # Concatenate the class token to the beginning of the input sequence
-        x = torch.cat((cls_tokens, x), dim=1)  # [batch_size, num_patches + 1, embed_dim]
-        return x
+        # Write the class token and the patches into a single preallocated sequence
+        out = x.new_empty(batch_size, x.size(1) + 1, x.size(2))  # [batch_size, num_patches + 1, embed_dim]
+        out[:, :1].copy_(cls_tokens)
+        out[:, 1:].copy_(x)
+        return out
     
 class MultiHeadSelfAttention(nn.Module):
     def __init__(self, embed_dim, num_heads, dropout=0.1):
@@ -177,13 +289,16 @@ class MultiHeadSelfAttention(nn.Module):
         self.proj = nn.Linear(embed_dim, embed_dim)
         self.proj_dropout = nn.Dropout(dropout)
 
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, block_mask=None):
         """
         Forward pass for multi-head self-attention.
 
         Args:
             x (torch.Tensor): Input embeddings of shape [batch_size, seq_len, embed_dim].
             mask (torch.Tensor, optional): Mask of shape [batch_size, seq_len].
+            block_mask (BlockMask, optional): FlexAttention block mask. When given, attention runs through
+                                              the compiled FlexAttention kernel and ``mask`` is ignored.
+                                              Attention dropout is not applied on this path.
 
         Returns:
             torch.Tensor: Output embeddings of shape [batch_size, seq_len, embed_dim].
@@ -192,30 +307,33 @@ class MultiHeadSelfAttention(nn.Module):
         assert embed_dim == self.embed_dim, f"Input embedding dim ({embed_dim}) must match layer embed_dim ({self.embed_dim})"
 
         # Compute query, key, and value
-        qkv = self.qkv(x)  # [batch_size, seq_len, 3 * embed_dim]
-        qkv = qkv.reshape(batch_size, seq_len, 3, self.num_heads, self.head_dim)
-        qkv = qkv.permute(2, 0, 3, 1, 4)  # [3, batch_size, num_heads, seq_len, head_dim]
-        q, k, v = qkv[0], qkv[1], qkv[2]  # Split into query, key, value
-
-        # Scaled dot-product attention
-        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.head_dim)  # [batch_size, num_heads, seq_len, seq_len]
+        qkv = self.qkv(x).view(batch_size, seq_len, 3, self.num_heads, self.head_dim)
+        q, k, v = qkv.unbind(dim=2)  # Each [batch_size, seq_len, num_heads, head_dim]
+        q, k, v = q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)  # [batch_size, num_heads, seq_len, head_dim]
 
-        # # Clamp scores to prevent extremely large values
-        # scores = torch.clamp(scores, min=-1e9, max=1e9)
+        if block_mask is not None:
+            # Padding is already encoded in the block mask, so the fused kernel skips padded blocks
+            out = _get_flex_attention()(q, k, v, block_mask=block_mask)  # [batch_size, num_heads, seq_len, head_dim]
+            out = out.transpose(1, 2).reshape(batch_size, seq_len, self.embed_dim)
+            out = self.proj(out)
+            out = self.proj_dropout(out)
+            return out
 
-        # Apply mask if provided
+        # Apply mask if provided, as an additive bias (0 = keep, dtype min = padded).
+        # A finite minimum instead of -inf keeps fully padded sequences from producing NaN rows;
+        # their outputs are discarded by the masked pooling downstream anyway
         if mask is not None:
-            mask = mask.unsqueeze(1).unsqueeze(2)  # [batch_size, 1, 1, seq_len]
-            scores = scores.masked_fill(mask == 0, float('-inf'))
+            mask = mask[:, None, None, :].to(q.dtype)  # [batch_size, 1, 1, seq_len]
+            mask = (1.0 - mask) * torch.finfo(q.dtype).min
 
-        # Compute attention weights
-        attn = torch.softmax(scores, dim=-1)  # [batch_size, num_heads, seq_len, seq_len]
-        attn = torch.nan_to_num(attn, nan=0.0)
-        attn = self.attn_dropout(attn)
-
-        # Weighted sum of values
-        out = torch.matmul(attn, v)  # [batch_size, num_heads, seq_len, head_dim]
-        out = out.transpose(1, 2).contiguous().view(batch_size, seq_len, self.embed_dim)  # [batch_size, seq_len, embed_dim]
+        # Fused scaled dot-product attention (dispatches to Flash / memory-efficient kernels when available)
+        out = F.scaled_dot_product_attention(
+            q, k, v,
+            attn_mask=mask,
+            dropout_p=self.attn_dropout.p if self.training else 0.0,
+            is_causal=False
+        )  # [batch_size, num_heads, seq_len, head_dim]
+        out = out.transpose(1, 2).reshape(batch_size, seq_len, self.embed_dim)  # [batch_size, seq_len, embed_dim]
 
         # Output projection
         out = self.proj(out)
@@ -223,7 +341,7 @@ class MultiHeadSelfAttention(nn.Module):
         return out
     
 class TransformerEncoderLayer(nn.Module):
-    def __init__(self, embed_dim, num_heads, mlp_dim, dropout=0.1):
+    def __init__(self, embed_dim, num_heads, mlp_dim, dropout=0.1, norm_type='layernorm'):
         """
         Initializes a single Transformer encoder layer.
         
@@ -232,12 +350,15 @@ class TransformerEncoderLayer(nn.Module):
             num_heads (int): Number of attention heads.
             mlp_dim (int): Dimension of the feed-forward network.
             dropout (float, optional): Dropout rate. Defaults to 0.1.
+            norm_type (str, optional): Pre-norm layer type: 'layernorm', 'fused_layernorm' or 'rmsnorm'.
+                                       RMSNorm skips mean centering (one reduction instead of two) but has
+                                       no bias, so its checkpoints differ. Defaults to 'layernorm'.
         """
         super(TransformerEncoderLayer, self).__init__()
         
         # Layer normalization before attention and MLP
-        self.norm1 = nn.LayerNorm(embed_dim)
-        self.norm2 = nn.LayerNorm(embed_dim)
+        self.norm1 = _make_norm(norm_type, embed_dim)
+        self.norm2 = _make_norm(norm_type, embed_dim)
         
         # Multi-head self-attention sublayer
         self.attn = MultiHeadSelfAttention(embed_dim, num_heads, dropout)
@@ -245,37 +366,50 @@ class TransformerEncoderLayer(nn.Module):
         # Feed-forward network (MLP) with dropout
         self.mlp = nn.Sequential(
             nn.Linear(embed_dim, mlp_dim),  # First linear layer
-            nn.GELU(),  # GELU activation
+            nn.GELU(approximate='tanh'),  # Tanh-approximated GELU (cheaper and fusable)
             nn.Dropout(dropout),  # Dropout for regularization
             nn.Linear(mlp_dim, embed_dim),  # Second linear layer
             nn.Dropout(dropout)  # Final dropout
         )
 
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, block_mask=None, inplace=False):
         """
         Forward pass of the Transformer encoder layer.
         
         Args:
             x (torch.Tensor): Input tensor of shape [batch_size, seq_len, embed_dim].
             mask (torch.Tensor, optional): Attention mask. Defaults to None.
+            block_mask (BlockMask, optional): FlexAttention block mask. Defaults to None.
+            inplace (bool, optional): Whether ``x`` may be overwritten when gradients are disabled.
+                                      Only set this for tensors the caller owns. Defaults to False.
         
         Returns:
-            torch.Tensor: Output tensor after the encoder layer.
+            torch.Tensor: Output tensor after the encoder layer. When gradients are
+                disabled and ``inplace`` is set, ``x`` is updated in place and returned.
         """
         # Validate input shape
         assert x.ndim == 3, f"Expected input shape [batch_size, seq_len, embed_dim], but got {x.shape}"
         assert x.size(2) == self.norm1.normalized_shape[0], f"Expected embed_dim={self.norm1.normalized_shape[0]}, but got {x.size(2)}"
         
-        # Self-attention sublayer with residual connection
-        x = x + self.attn(self.norm1(x), mask=mask)
-        
-        # Feed-forward sublayer with residual connection
-        x = x + self.mlp(self.norm2(x))
-        
+        # LayerNorm saves its input for backward, so the residual stream can only
+        # be updated in place when no autograd graph is being recorded
+        if torch.is_grad_enabled():
+            # Self-attention sublayer with residual connection
+            x = x + self.attn(self.norm1(x), mask=mask, block_mask=block_mask)
+
+            # Feed-forward sublayer with residual connection
+            x = x + self.mlp(self.norm2(x))
+        else:
+            # The first add writes a new tensor unless x may be overwritten; the second then only
+            # touches a tensor this layer created
+            attn_out = self.attn(self.norm1(x), mask=mask, block_mask=block_mask)
+            x = x.add_(attn_out) if inplace else x + attn_out
+            x = x.add_(self.mlp(self.norm2(x)))
+
         return x
     
 class TransformerEncoder(nn.Module):
-    def __init__(self, num_layers, embed_dim, num_heads, mlp_dim, dropout=0.1):
+    def __init__(self, num_layers, embed_dim, num_heads, mlp_dim, dropout=0.1, use_native_layers=False, norm_type='layernorm'):
         """
         Initializes the Transformer encoder by stacking multiple encoder layers.
         
@@ -285,49 +419,98 @@ class TransformerEncoder(nn.Module):
             num_heads (int): Number of attention heads.
             mlp_dim (int): Dimension of the feed-forward network.
             dropout (float, optional): Dropout rate. Defaults to 0.1.
+            use_native_layers (bool, optional): Whether to stack PyTorch's nn.TransformerEncoderLayer
+                                                (pre-norm, batch-first) instead of the custom layer, which
+                                                enables the fused encoder fast path at inference. Note that
+                                                the parameter names differ from the custom layers, so
+                                                checkpoints are not interchangeable. Defaults to False.
+            norm_type (str, optional): Pre-norm layer type of the custom layers ('layernorm', 'fused_layernorm'
+                                       or 'rmsnorm'). Defaults to 'layernorm'.
         """
         super(TransformerEncoder, self).__init__()
         
         # Ensure at least one layer is defined
         assert num_layers > 0, "num_layers must be greater than 0"
+        if use_native_layers and norm_type != 'layernorm':
+            raise ValueError("norm_type must be 'layernorm' when use_native_layers=True.")
         
-        # Create a stack of Transformer encoder layers
-        self.layers = nn.ModuleList(
-            [
-                TransformerEncoderLayer(embed_dim, num_heads, mlp_dim, dropout) 
-                for _ in range(num_layers)
-            ]
-        )
+        self.embed_dim = embed_dim
+        self.use_native_layers = use_native_layers
+        
+        if self.use_native_layers:
+            # Pre-norm, batch-first layers match the custom layer and are eligible for the fused kernels.
+            # Nested tensors are only supported by post-norm layers, so they stay disabled.
+            encoder_layer = nn.TransformerEncoderLayer(
+                d_model=embed_dim,
+                nhead=num_heads,
+                dim_feedforward=mlp_dim,
+                dropout=dropout,
+                activation='gelu',
+                batch_first=True,
+                norm_first=True
+            )
+            self.encoder = nn.TransformerEncoder(encoder_layer, num_layers=num_layers, enable_nested_tensor=False)
+        else:
+            # Create a stack of Transformer encoder layers
+            self.layers = nn.ModuleList(
+                [
+                    TransformerEncoderLayer(embed_dim, num_heads, mlp_dim, dropout, norm_type=norm_type) 
+                    for _ in range(num_layers)
+                ]
+            )
         
         # Final layer normalization
         self.norm = nn.LayerNorm(embed_dim)
 
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, block_mask=None):
         """
         Passes the input through each Transformer encoder layer.
         
         Args:
             x (torch.Tensor): Input tensor of shape [batch_size, seq_len, embed_dim].
             mask (torch.Tensor, optional): Attention mask. Defaults to None.
+            block_mask (BlockMask, optional): FlexAttention block mask, only supported by the custom
+                                              layers. Defaults to None.
         
         Returns:
             torch.Tensor: Output tensor after the Transformer encoder.
         """
         # Validate input shape
         assert x.ndim == 3, f"Expected input shape [batch_size, seq_len, embed_dim], but got {x.shape}"
-        assert x.size(2) == self.layers[0].norm1.normalized_shape[0], \
-            f"Input embed_dim ({x.size(2)}) must match encoder embed_dim ({self.layers[0].norm1.normalized_shape[0]})"
-        
-        # Pass through each encoder layer
-        for layer in self.layers:
-            x = layer(x, mask)
+        assert x.size(2) == self.embed_dim, \
+            f"Input embed_dim ({x.size(2)}) must match encoder embed_dim ({self.embed_dim})"
+        
+        if self.use_native_layers:
+            # Convert the validity mask (1 = valid) into a key padding mask (True = padded)
+            padding_mask = None
+            if mask is not None:
+                keep = mask.bool()
+                # Let fully padded sequences attend everywhere so they don't produce NaN rows
+                keep = keep | ~keep.any(dim=-1, keepdim=True)
+                padding_mask = ~keep
+            x = self.encoder(x, src_key_padding_mask=padding_mask)
+        else:
+            # Pass through each encoder layer; the input belongs to the caller, so only tensors
+            # produced by earlier layers are updated in place
+            for i, layer in enumerate(self.layers):
+                x = layer(x, mask, block_mask=block_mask, inplace=i > 0)
         
         # Apply final layer normalization
         x = self.norm(x)
         return x
     
 class TemporalTransformerEncoder(nn.Module):
-    def __init__(self, embed_dim=768, num_heads=12, num_layers=6, mlp_dim=3072, dropout=0.1):
+    def __init__(
+        self,
+        embed_dim=768,
+        num_heads=12,
+        num_layers=6,
+        mlp_dim=3072,
+        dropout=0.1,
+        use_native_layers=False,
+        use_flex_attention=False,
+        norm_type='layernorm',
+    ):
         """
         Initializes the Temporal Transformer Encoder.
         
@@ -337,9 +520,27 @@ class TemporalTransformerEncoder(nn.Module):
             num_layers (int, optional): Number of Transformer encoder layers. Defaults to 6.
             mlp_dim (int, optional): Dimension of the feed-forward network. Defaults to 3072.
             dropout (float, optional): Dropout rate. Defaults to 0.1.
+            use_native_layers (bool, optional): Whether to use PyTorch's nn.TransformerEncoderLayer. Defaults to False.
+            use_flex_attention (bool, optional): Whether to run masked attention through FlexAttention with a
+                                                 block mask built once per batch. Only used at inference on
+                                                 CUDA, since FlexAttention has no attention dropout; other
+                                                 cases fall back to SDPA. Requires PyTorch >= 2.5. Defaults to False.
+            norm_type (str, optional): Pre-norm layer type of the encoder layers. Defaults to 'layernorm'.
         """
         super(TemporalTransformerEncoder, self).__init__()
-        self.transformer_encoder = TransformerEncoder(num_layers, embed_dim, num_heads, mlp_dim, dropout)
+        
+        if use_flex_attention:
+            if flex_attention is None:
+                raise ValueError("use_flex_attention requires PyTorch >= 2.5 (torch.nn.attention.flex_attention).")
+            if use_native_layers:
+                raise ValueError("use_flex_attention is not supported with use_native_layers.")
+        self.use_flex_attention = use_flex_attention
+        
+        self.transformer_encoder = TransformerEncoder(
+            num_layers, embed_dim, num_heads, mlp_dim, dropout,
+            use_native_layers=use_native_layers,
+            norm_type=norm_type
+        )
         self.norm = nn.LayerNorm(embed_dim)
 
     def forward(self, x, mask=None):
@@ -358,20 +559,33 @@ class TemporalTransformerEncoder(nn.Module):
         assert mask is None or mask.shape == x.shape[:2], \
             f"Mask shape {mask.shape} must match input shape {x.shape[:2]}"
 
+        # Build the FlexAttention block mask once per batch and share it across layers
+        block_mask = None
+        if self.use_flex_attention and mask is not None and x.is_cuda and not self.training:
+            kv_mask = mask.bool()
+
+            def mask_mod(b, h, q_idx, kv_idx):
+                return kv_mask[b, kv_idx]
+
+            block_mask = create_block_mask(mask_mod, x.size(0), None, x.size(1), x.size(1), device=x.device)
+
         # Pass through transformer encoder
-        x = self.transformer_encoder(x, mask=mask)
+        x = self.transformer_encoder(x, mask=mask, block_mask=block_mask)
         x = self.norm(x)
 
         # Aggregate sequence information
         if mask is not None:
-            x = x * mask.unsqueeze(-1)  # Zero out padded frames
-            lengths = mask.sum(dim=1, keepdim=True).clamp(min=1)  # Avoid division by zero
-            x = x.sum(dim=1) / lengths  # Mean over valid frames
+            # Mean over valid frames as a single contraction (no masked copy of x)
+            m = mask.to(x.dtype)
+            x = torch.einsum('btd,bt->bd', x, m) / m.sum(1, keepdim=True).clamp_(min=1)
         else:
             x = x.mean(dim=1)  # Mean over all frames
         return x
     
 class VisionTransformerWithTemporal(nn.Module):
+    # Maximum number of captured spatial CUDA graphs kept at once (one per input signature)
+    max_cuda_graphs = 4
+
     def __init__(
         self,
         img_size=224,
@@ -389,6 +603,15 @@ class VisionTransformerWithTemporal(nn.Module):
         temporal_num_heads=12,
         temporal_mlp_dim=3072,
         temporal_dropout=0.1,
+        use_native_layers=False,
+        compile_encoders=False,
+        allow_tf32=False,
+        use_bf16=False,
+        channels_last=False,
+        use_flex_attention=False,
+        norm_type='layernorm',
+        use_cuda_graph=False,
+        half_precision_pos_encoding=False,
     ):
         """
         Vision Transformer with Temporal Modeling.
@@ -409,22 +632,64 @@ class VisionTransformerWithTemporal(nn.Module):
             temporal_num_heads (int): Number of attention heads for the temporal model.
             temporal_mlp_dim (int): Feed-forward network dimension in the temporal transformer.
             temporal_dropout (float): Dropout rate in the temporal transformer.
+            use_native_layers (bool): Whether both encoders use PyTorch's nn.TransformerEncoderLayer
+                                      to pick up the fused encoder fast path.
+            compile_encoders (bool): Whether to compile the spatial and temporal encoders with
+                                     torch.compile (mode='max-autotune', dynamic=False). Input shapes
+                                     (batch size, sequence length, image size) should stay fixed to
+                                     avoid recompilation.
+            allow_tf32 (bool): Whether to enable TF32 matmuls/convolutions and cuDNN benchmarking.
+                               These are global backend settings.
+            use_bf16 (bool): Whether to run the spatial and temporal encoders under bfloat16 autocast.
+                             The classification head always runs in fp32.
+            channels_last (bool): Whether the patch embedding runs in channels_last memory format.
+            use_flex_attention (bool): Whether the temporal encoder uses FlexAttention for its padding mask
+                                       at inference (PyTorch >= 2.5).
+            norm_type (str): Pre-norm layer type inside both encoders: 'layernorm', 'fused_layernorm'
+                             (apex, if installed) or 'rmsnorm'.
+            use_cuda_graph (bool): Whether to capture the spatial ViT forward in a CUDA graph and replay it.
+                                   Only used in eval mode on CUDA with gradients disabled. One graph is
+                                   kept per input shape, dtype, device, autocast state and dtype, and
+                                   inference mode (up to max_cuda_graphs, e.g. full and final partial
+                                   batches); each holds its own static buffers. Graphs are discarded when
+                                   the model is moved or cast, or a state dict is loaded.
+            half_precision_pos_encoding (bool): Whether the spatial positional encoding is added in the
+                                                activations' half precision under autocast, keeping the
+                                                residual stream in fp16/bf16 instead of promoting it to fp32.
+                                                This changes training numerics.
         """
         super(VisionTransformerWithTemporal, self).__init__()
         
+        if use_cuda_graph and compile_encoders:
+            raise ValueError("use_cuda_graph cannot be combined with compile_encoders (max-autotune already uses CUDA graphs).")
+        
+        self.use_bf16 = use_bf16
+        self.use_cuda_graph = use_cuda_graph
+        self.check_nan = os.environ.get('DEBUG_NAN', '0') not in ('', '0')
+        
+        # CUDA graphs for the spatial forward, captured lazily: key -> (graph, static_in, static_out).
+        # Graphs hold raw parameter addresses, so they are dropped whenever parameters may be reallocated
+        self._graphs = {}
+        self.register_load_state_dict_post_hook(lambda module, incompatible_keys: module._graphs.clear())
+        
         # Vision Transformer Components
-        self.patch_embed = PatchEmbedding(img_size, patch_size, in_channels, embed_dim)
+        self.use_cls_token = use_cls_token
+        self.num_tokens = 1 if self.use_cls_token else 0
+        
+        # Patch embedding reserves the class token slot so no concatenation is needed
+        self.patch_embed = PatchEmbedding(
+            img_size, patch_size, in_channels, embed_dim,
+            num_tokens=self.num_tokens,
+            channels_last=channels_last
+        )
         num_patches = self.patch_embed.num_patches
         
-        self.use_cls_token = use_cls_token
         if self.use_cls_token:
             self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
             nn.init.trunc_normal_(self.cls_token, std=0.02)
-            self.pos_encoder = PositionalEncoding(embed_dim, max_len=num_patches + 1)
-            self.num_tokens = 1
-        else:
-            self.pos_encoder = PositionalEncoding(embed_dim, max_len=num_patches)
-            self.num_tokens = 0
+        self.pos_encoder = PositionalEncoding(
+            embed_dim, max_len=num_patches + self.num_tokens, half_precision=half_precision_pos_encoding
+        )
 
         self.dropout = nn.Dropout(emb_dropout)
         self.transformer_encoder = TransformerEncoder(
@@ -432,7 +697,9 @@ class VisionTransformerWithTemporal(nn.Module):
             embed_dim=embed_dim, 
             num_heads=num_heads, 
             mlp_dim=mlp_dim, 
-            dropout=dropout
+            dropout=dropout,
+            use_native_layers=use_native_layers,
+            norm_type=norm_type
         )
         self.norm = nn.LayerNorm(embed_dim)
         
@@ -442,68 +709,177 @@ class VisionTransformerWithTemporal(nn.Module):
             num_heads=temporal_num_heads,
             num_layers=temporal_num_layers,
             mlp_dim=temporal_mlp_dim,
-            dropout=temporal_dropout
+            dropout=temporal_dropout,
+            use_native_layers=use_native_layers,
+            use_flex_attention=use_flex_attention,
+            norm_type=norm_type
         )
         
         # Classification Head
         self.head = nn.Linear(embed_dim, num_classes)
         nn.init.trunc_normal_(self.head.weight, std=0.02)
         nn.init.zeros_(self.head.bias)
+        
+        if allow_tf32:
+            enable_tf32()
+        
+        # NaN checking forces a device-to-host sync, so it is only enabled for debug runs
+        if self.check_nan:
+            self.norm.register_forward_hook(self._check_nan_hook)
+        
+        if compile_encoders:
+            compile_in_place(self.transformer_encoder, self.temporal_encoder)
     
-    def forward(self, x, img_mask=None, seq_mask=None):
+    @staticmethod
+    def _check_nan_hook(module, inputs, output):
         """
-        Forward pass of the Vision Transformer with Temporal Modeling.
+        Forward hook raising if the spatial encoder output contains NaNs (enabled with DEBUG_NAN=1).
+        """
+        if torch.isnan(output).any():
+            raise ValueError("NaN detected after Transformer encoder.")
+    
+    def _spatial_forward(self, x):
+        """
+        Encodes a batch of frames with the spatial Vision Transformer.
         
         Args:
-            x (torch.Tensor): Input tensor of shape [batch_size, seq_len, in_channels, img_size, img_size].
-            img_mask (torch.Tensor, optional): Mask for valid images [batch_size, seq_len].
-            seq_mask (torch.Tensor, optional): Mask for valid sequences [batch_size, seq_len].
+            x (torch.Tensor): Frames of shape [num_frames, in_channels, img_size, img_size].
         
         Returns:
-            torch.Tensor: Classification logits of shape [batch_size, num_classes].
+            torch.Tensor: Frame features of shape [num_frames, embed_dim].
         """
-        # Validate input shape
-        batch_size, seq_len, in_channels, img_size, _ = x.shape
-        assert img_size == self.patch_embed.img_size, \
-            f"Input img_size {img_size} does not match expected size {self.patch_embed.img_size}"
-        
-        # Flatten sequence dimension for image-level processing
-        x = x.view(batch_size * seq_len, in_channels, img_size, img_size)
-        
-        # Patch embedding
+        # Patch embedding (with the class token slot reserved at index 0 if enabled)
         x = self.patch_embed(x)
         
-        # Add class token if enabled
+        # Fill the class token slot if enabled
         if self.use_cls_token:
-            cls_tokens = self.cls_token.expand(batch_size * seq_len, -1, -1)
-            x = torch.cat((cls_tokens, x), dim=1)
+            x[:, 0].copy_(self.cls_token.view(1, -1).expand(x.size(0), -1))
         
         # Positional encoding and dropout
         x = self.pos_encoder(x)
         x = self.dropout(x)
         
         # Vision Transformer Encoding
-        # if img_mask is not None:
-        #     img_mask = img_mask.view(batch_size * seq_len, -1)
         x = self.transformer_encoder(x)
         x = self.norm(x)
-
-        # Check for NaNs after Transformer encoder
-        if torch.isnan(x).any():
-            raise ValueError("NaN detected after Transformer encoder.")
         
         # Extract features
         if self.use_cls_token:
-            x = x[:, 0]
-        else:
-            x = x.mean(dim=1)
+            return x[:, 0]
+        return x.mean(dim=1)
+    
+    def _apply(self, fn, *args, **kwargs):
+        """Drops captured CUDA graphs before .to()/.half()/.cuda() and similar reallocate parameters."""
+        self._graphs.clear()
+        return super(VisionTransformerWithTemporal, self)._apply(fn, *args, **kwargs)
+    
+    def _capture_spatial_graph(self, x, key):
+        """
+        Captures the spatial forward for inputs like ``x`` into a CUDA graph.
+        
+        Args:
+            x (torch.Tensor): Example frames of shape [num_frames, in_channels, img_size, img_size].
+            key (tuple): Shape/dtype/device/autocast/inference-mode signature the graph is valid for.
+        
+        Returns:
+            tuple: (graph, static_in, static_out) for replaying the capture.
+        """
+        static_in = x.clone()
+        
+        # Cached autocast casts would be freed while the graph still points at them, and the
+        # patch embedding's shared scratch could be reallocated by a later eager call
+        cache_enabled = torch.is_autocast_cache_enabled()
+        torch.set_autocast_cache_enabled(False)
+        self.patch_embed.reuse_scratch = False
+        try:
+            # Warm up on a side stream so lazy initialization (cuBLAS handles) happens outside capture
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    self._spatial_forward(static_in)
+            torch.cuda.current_stream().wait_stream(stream)
+            
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                static_out = self._spatial_forward(static_in)
+        finally:
+            torch.set_autocast_cache_enabled(cache_enabled)
+            self.patch_embed.reuse_scratch = True
+        
+        # Evict the oldest graph once the cache is full
+        if len(self._graphs) >= self.max_cuda_graphs:
+            del self._graphs[next(iter(self._graphs))]
+        self._graphs[key] = (graph, static_in, static_out)
+        return self._graphs[key]
+    
+    def _spatial_forward_graphed(self, x):
+        """
+        Runs the spatial forward by replaying a captured CUDA graph, capturing it first if needed.
         
-        # Reshape for temporal processing
-        x = x.view(batch_size, seq_len, -1)
+        Args:
+            x (torch.Tensor): Frames of shape [num_frames, in_channels, img_size, img_size].
         
-        # Temporal Transformer Encoding
-        x = self.temporal_encoder(x, mask=seq_mask)
+        Returns:
+            torch.Tensor: Frame features of shape [num_frames, embed_dim].
+        """
+        # Inference-mode captures leave static_in as an inference tensor, so the mode is part of the key
+        key = (x.shape, x.dtype, x.device, torch.is_autocast_enabled(),
+               torch.get_autocast_dtype('cuda'), torch.is_inference_mode_enabled())
+        entry = self._graphs.get(key)
+        if entry is None:
+            entry = self._capture_spatial_graph(x, key)
+        graph, static_in, static_out = entry
+        
+        static_in.copy_(x)
+        graph.replay()
+        # The output buffer is overwritten by the next replay
+        return static_out.clone()
+    
+    def forward(self, x, img_mask=None, seq_mask=None):
+        """
+        Forward pass of the Vision Transformer with Temporal Modeling.
         
-        # Classification
-        logits = self.head(x)
+        Args:
+            x (torch.Tensor): Input tensor of shape [batch_size, seq_len, in_channels, img_size, img_size].
+            img_mask (torch.Tensor, optional): Mask for valid images [batch_size, seq_len].
+            seq_mask (torch.Tensor, optional): Mask for valid sequences [batch_size, seq_len].
+        
+        Returns:
+            torch.Tensor: Classification logits of shape [batch_size, num_classes].
+        """
+        # Validate input shape
+        batch_size, seq_len, in_channels, img_size, _ = x.shape
+        assert img_size == self.patch_embed.img_size, \
+            f"Input img_size {img_size} does not match expected size {self.patch_embed.img_size}"
+        
+        # Both encoders run in bfloat16 when enabled (same exponent range as fp32, so no loss scaling);
+        # otherwise any autocast region set up by the caller applies unchanged
+        if self.use_bf16:
+            precision = torch.autocast(device_type=x.device.type, dtype=torch.bfloat16)
+        else:
+            precision = contextlib.nullcontext()
+        with precision:
+            # Flatten sequence dimension for image-level processing
+            x = x.flatten(0, 1)  # [batch_size * seq_len, in_channels, img_size, img_size], a view when strides allow
+            
+            # Vision Transformer Encoding (replayed from a CUDA graph at inference when enabled;
+            # the NaN hook syncs with the host, which is not allowed during capture)
+            # if img_mask is not None:
+            #     img_mask = img_mask.view(batch_size * seq_len, -1)
+            if (self.use_cuda_graph and x.is_cuda and not self.training
+                    and not torch.is_grad_enabled() and not self.check_nan):
+                x = self._spatial_forward_graphed(x)
+            else:
+                x = self._spatial_forward(x)
+            
+            # Reshape for temporal processing
+            x = x.unflatten(0, (batch_size, seq_len))  # [batch_size, seq_len, embed_dim]
+            
+            # Temporal Transformer Encoding
+            x = self.temporal_encoder(x, mask=seq_mask)
+        
+        # Classification (kept in fp32)
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            logits = self.head(x.float())
         return logits
\ No newline at end of file
@@ -16,7 +16,7 @@ from tqdm import tqdm
 
 def train_one_epoch(
     model, train_loader, criterion, optimizer, device, scaler,
-    adversary=None, max_grad_norm=1.0
+    adversary=None, max_grad_norm=1.0, batch_transform=None
 ):
     """
     Trains the model for one epoch, optionally using adversarial training.
@@ -30,6 +30,8 @@ def train_one_epoch(
         scaler (GradScaler): Gradient scaler for mixed precision.
         adversary (AdversarialAttack, optional): Adversary for adversarial training.
         max_grad_norm (float, optional): Maximum gradient norm for clipping. Defaults to 1.0.
+        batch_transform (callable, optional): Transform applied to each input batch after it is moved
+            to the device (e.g. gpu_preprocess for datasets returning raw uint8 frames).
 
     Returns:
         tuple: (epoch_loss, epoch_accuracy, epoch_f1, lr_list)
@@ -45,7 +47,10 @@ def train_one_epoch(
         for batch_inputs, batch_masks, batch_labels in pbar:
             batch_inputs = batch_inputs.to(device, non_blocking=True)
             batch_masks = batch_masks.to(device, non_blocking=True)
-            batch_labels = batch_labels.to(device, non_blocking=True)
+            # Labels arrive as a compact int8 tensor; cast once per batch for the loss
+            batch_labels = batch_labels.to(device, non_blocking=True).long()
+            if batch_transform is not None:
+                batch_inputs = batch_transform(batch_inputs)
 
             optimizer.zero_grad()
 
@@ -126,7 +131,7 @@ def train_one_epoch(
     return epoch_loss, epoch_accuracy, epoch_f1, lr_list
 
 
-def evaluate(model, data_loader, criterion, device, classes=['neg', 'pos'], mode='Validation'):
+def evaluate(model, data_loader, criterion, device, classes=['neg', 'pos'], mode='Validation', batch_transform=None):
     """
     Evaluates the model on a given dataset and prints classification metrics.
 
@@ -137,6 +142,8 @@ def evaluate(model, data_loader, criterion, device, classes=['neg', 'pos'], mode
         device (torch.device): Device to run evaluation on.
         classes (list, optional): List of class names. Defaults to ['neg', 'pos'].
         mode (str, optional): Mode name for display purposes. Defaults to 'Validation'.
+        batch_transform (callable, optional): Transform applied to each input batch after it is moved
+            to the device. Defaults to None.
 
     Returns:
         dict: Dictionary containing loss, accuracy, and F1-score.
@@ -153,7 +160,9 @@ def evaluate(model, data_loader, criterion, device, classes=['neg', 'pos'], mode
             for inputs, masks, labels in pbar:
                 inputs = inputs.to(device, non_blocking=True)
                 masks = masks.to(device, non_blocking=True)
-                labels = labels.to(device, non_blocking=True)
+                labels = labels.to(device, non_blocking=True).long()
+                if batch_transform is not None:
+                    inputs = batch_transform(inputs)
                 
                 # Mixed precision inference
                 if "cuda" in device.type and torch.cuda.is_available():
@@ -217,7 +226,8 @@ def train(
     patience=10,
     checkpoint_dir='checkpoints',
     save_every=1,
-    adversary=None
+    adversary=None,
+    batch_transform=None
 ):
     """
     Orchestrates the training, validation, and test process over multiple epochs.
@@ -236,6 +246,8 @@ def train(
         checkpoint_dir (str, optional): Directory to save checkpoints. Defaults to 'checkpoints'.
         save_every (int, optional): Save a checkpoint every 'save_every' epochs. Defaults to 1.
         adversary (AdversarialAttack, optional): Adversary for adversarial training.
+        batch_transform (callable, optional): Transform applied to every input batch on the device,
+            e.g. gpu_preprocess for datasets created with gpu_transform=True.
 
     Returns:
         pd.DataFrame: DataFrame containing training history.
@@ -273,7 +285,8 @@ def train(
         train_loss, train_acc, train_f1, lr_list = train_one_epoch(
             model, train_loader, criterion, optimizer, device, scaler,
             adversary=adversary,  # Pass the adversary
-            max_grad_norm=1.0
+            max_grad_norm=1.0,
+            batch_transform=batch_transform
         )
 
         # Store the average learning rate from this epoch
@@ -285,7 +298,7 @@ def train(
 
         # Validation Phase
         val_metrics = evaluate(
-            model, val_loader, criterion, device, mode='Validation'
+            model, val_loader, criterion, device, mode='Validation', batch_transform=batch_transform
         )
         val_loss = val_metrics['loss']
         val_accuracy = val_metrics['accuracy']
@@ -293,7 +306,7 @@ def train(
 
         # Test Phase
         test_metrics = evaluate(
-            model, test_loader, criterion, device, mode='Test'
+            model, test_loader, criterion, device, mode='Test', batch_transform=batch_transform
         )
         test_loss = test_metrics['loss']
         test_accuracy = test_metrics['accuracy']
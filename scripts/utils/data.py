@@ -1,10 +1,57 @@
 import os
+import io
+import hashlib
+import pickle
+import numpy as np
 import torch
-from torch.utils.data import Dataset
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import Dataset, IterableDataset
 from PIL import Image
 import matplotlib.pyplot as plt
 from torchvision import transforms
+from torchvision.transforms import v2
+from torchvision.io import decode_jpeg, read_file, ImageReadMode
 import random
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+# libjpeg-turbo decoding is optional; frames fall back to PIL when it is unavailable
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _TURBO_JPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    _TURBO_JPEG = None
+
+# WebDataset shards are optional; only DriverDrowsinessWebDataset needs them
+try:
+    import webdataset as wds
+except ImportError:
+    wds = None
+
+# ImageNet normalization constants, shaped to broadcast over [seq_len, 3, H, W]
+_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+# Thread pool for decoding the frames of a sequence in parallel (decoders release the GIL)
+_DECODE_POOL = None
+_DECODE_POOL_PID = None
+
+
+def _get_decode_pool():
+    """
+    Return the frame decoding thread pool, creating it on first use in each process.
+
+    Threads do not survive a fork, so DataLoader workers get their own pool instead of
+    inheriting the parent's dead one.
+    """
+    global _DECODE_POOL, _DECODE_POOL_PID
+    if _DECODE_POOL is None or _DECODE_POOL_PID != os.getpid():
+        _DECODE_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+        _DECODE_POOL_PID = os.getpid()
+    return _DECODE_POOL
 
 
 class DriverDrowsinessDataset(Dataset):
@@ -19,22 +66,83 @@ class DriverDrowsinessDataset(Dataset):
     - Synchronized transformations across frames during training
     - Masking for valid/invalid frames
     - Limiting the number of image frames per sequence via max_length
+    - Caching the scanned sequence index on disk via index_cache_dir
+    - Tensor-native ``torchvision.transforms.v2`` pipelines, applied once to the whole
+      uint8 sequence so every frame shares the same random parameters
+    - Returning raw uint8 frames (gpu_transform) so resizing and normalization can run
+      on the GPU after collation (see gpu_preprocess)
+    - Caching decoded sequences as memory-mapped .npy files via cache_dir
+    - Returning frames in channels_last layout (batch with collate_channels_last)
+    - Returning the number of valid frames instead of a mask (batch with collate_valid_len)
+
+    Sequences are stored as a compact index rather than lists of paths: ``dirs`` holds each
+    sequence directory once, ``frames`` the sorted filenames of each directory, and ``index``
+    an int32 array of ``[dir_id, start_frame, label]`` rows, one per window. Paths are only
+    joined for the frames of the requested window.
     """
 
-    def __init__(self, root_dir, split='train', transform=None, seq_len=16, padding_value=0.0, default_img_size=224, stride=None, max_length=None):
+    def __init__(self, root_dir, split='train', transform=None, seq_len=16, padding_value=0.0, default_img_size=224, stride=None, max_length=None, index_cache_dir=None, gpu_transform=False, cache_dir=None, channels_last=False, validate=False, return_valid_len=False, script_transform=False, return_bytes=False, decode_size=None):
         """
         Initialize dataset with configuration parameters and load data paths.
 
         Args:
             root_dir (str): Root directory containing split subdirectories
             split (str): Dataset split ('train', 'val', 'test')
-            transform (callable): Optional transforms to apply to images
+            transform (callable): Optional transforms to apply to images. A ``transforms.v2``
+                                  transform is applied once to the [seq_len, 3, H, W] uint8 sequence
+                                  (include ``v2.ToDtype(torch.float32, scale=True)`` before
+                                  normalization, or ``v2.ConvertImageDtype(torch.float32)`` with
+                                  script_transform); other transforms are applied per PIL frame.
             seq_len (int): Length of image sequences
             padding_value (float): Value for padding incomplete sequences
             default_img_size (int): Size for dummy images when padding
             stride (int, optional): Stride for creating overlapping sequences
             max_length (int, optional): Maximum number of image frames to include per sequence. 
                                          If None, includes all frames.
+            index_cache_dir (str, optional): Directory in which to cache the scanned sequence index.
+                                             The cache is reused while the split, label and sequence
+                                             directories are unchanged (by mtime), so re-instantiating
+                                             skips listing every frame. If None, no cache is used.
+            gpu_transform (bool): If True, skip ``transform`` and return raw uint8 frames
+                                  [seq_len, 3, H_raw, W_raw]; resize and normalize batches on the
+                                  device with gpu_preprocess (e.g. via ``batch_transform`` in train()).
+                                  Transfers are 4x smaller than float32 frames.
+            cache_dir (str, optional): Directory for caching decoded sequences as uint8 .npy files
+                                       (one per window, keyed by its frame paths). Later epochs read
+                                       them through the page cache instead of decoding again;
+                                       transforms and augmentation are still applied after loading.
+                                       If None, frames are decoded every time.
+            channels_last (bool): If True, return image tensors in channels_last (NHWC) memory format.
+                                  Use collate_channels_last as the DataLoader's collate_fn so the
+                                  batch keeps the layout, and enable channels_last on the model's
+                                  patch embedding. Values are unchanged.
+            validate (bool): If True, check every transformed sequence for NaN/Inf values. This
+                             is a full scan per sample, so it is off by default and meant for
+                             debugging the data pipeline.
+            return_valid_len (bool): If True, return ``(images, valid_len, label)`` where valid_len is
+                                     the number of non-padded frames (padding is always at the tail),
+                                     instead of a [seq_len] bool mask. Use collate_valid_len to rebuild
+                                     the batch mask. Frames that fail to load count as valid here.
+            script_transform (bool): If True and ``transform`` is a ``transforms.v2.Compose``, compile it
+                                     with torch.jit.script as an nn.Sequential to drop the per-op Python
+                                     dispatch. Each v2 step is scripted through its v1 counterpart, so
+                                     only v2 ops that have one can be used, e.g.
+                                     ``v2.Compose([v2.Resize(224), v2.ConvertImageDtype(torch.float32),
+                                     v2.Normalize(mean, std)])``. ``v2.ToDtype`` and ``v2.ToImage`` have
+                                     no scriptable form. Scripting happens lazily on the first sample in
+                                     each process (ScriptModules cannot be pickled to spawned DataLoader
+                                     workers). If it fails, a warning is issued and the transform is used
+                                     as is.
+            return_bytes (bool): If True, skip decoding and return the window's encoded files as a list
+                                 of 1-D uint8 tensors (valid frames only) in place of the images. Use
+                                 JPEGBatchDecoder as the collate_fn to decode the whole batch at once,
+                                 optionally on the GPU. JPEG frames only; cannot be combined with
+                                 ``transform``, ``gpu_transform``, ``channels_last`` or ``return_valid_len``.
+            decode_size (int, optional): If set, JPEGs are decoded at the largest reduced DCT scale
+                                         (1/2, 1/4 or 1/8) that keeps both sides at least this many
+                                         pixels, with either decoder. Set it to no less than the size
+                                         your transforms resize or crop to. If None, frames are
+                                         decoded at full resolution.
         """
         # Store initialization parameters
         self.root_dir = root_dir
@@ -42,54 +150,375 @@ class DriverDrowsinessDataset(Dataset):
         self.transform = transform
         self.seq_len = seq_len
         self.padding_value = padding_value
-        self.sequences = []  # List to store image paths
-        self.labels = []     # List to store corresponding labels
         self.default_size = default_img_size
         self.stride = stride if stride is not None else seq_len // 2
         self.max_length = max_length  # NEW: Store max_length parameter
+        self.index_cache_dir = index_cache_dir
+        self.gpu_transform = gpu_transform
+        self.cache_dir = cache_dir
+        self.channels_last = channels_last
+        self.validate = validate
+        self.return_valid_len = return_valid_len
+        self.return_bytes = return_bytes
+        self.decode_size = decode_size
+        
+        # Tensor-native transforms run once per sequence on the stacked uint8 frames
+        self.batched_transform = isinstance(transform, v2.Transform)
+        self.script_transform = script_transform
+        if script_transform and not isinstance(transform, v2.Compose):
+            warnings.warn("script_transform requires a transforms.v2.Compose; using the transform unscripted.")
+            self.script_transform = False
+        self._scripted_transform = None  # Built per process on first use, never pickled
+        
+        # Transformed padding frame, computed once on first use (per-frame PIL path only)
+        self._pad_tensor = None
 
         # Validate split parameter
         if split not in ['train', 'val', 'test']:
             raise ValueError(f"Invalid split: {split}. Must be one of 'train', 'val', 'test'.")
+        
+        # Encoded frames are decoded by JPEGBatchDecoder, which needs the bool mask and applies no transforms
+        if return_bytes:
+            conflicts = [name for name, value in [
+                ('channels_last', channels_last), ('return_valid_len', return_valid_len),
+                ('transform', transform is not None), ('gpu_transform', gpu_transform),
+            ] if value]
+            if conflicts:
+                raise ValueError(f"return_bytes cannot be combined with: {', '.join(conflicts)}.")
 
         split_dir = os.path.join(root_dir, split)
         
-        # Process positive and negative samples
+        # Find sequence directories and their labels
+        sequence_dirs = []
         for label in ['pos', 'neg']:
             label_dir = os.path.join(split_dir, label)
             if not os.path.exists(label_dir):
                 print(f"Warning: Directory {label_dir} not found.")
                 continue
+            # DirEntry carries the joined path and file type from the directory read itself
+            with os.scandir(label_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        sequence_dirs.append((entry.path, 1 if label == 'pos' else 0))
+        
+        if self.index_cache_dir is None:
+            self._build_index(sequence_dirs)
+        else:
+            # Reuse a cached index if none of the directories changed since it was built (the
+            # signature stats every directory, so it is only computed when caching is enabled)
+            signature = self._index_signature(split_dir, sequence_dirs)
+            cache_path = self._index_cache_path(split_dir)
+            cached = self._load_index_cache(cache_path, signature)
+            if cached is not None:
+                self.dirs, self.frames, self.index = cached
+            else:
+                self._build_index(sequence_dirs)
+                self._save_index_cache(cache_path, signature)
+        
+        # Directory prefixes with a trailing separator; frame paths are joined only on load
+        self.dir_prefixes = [os.path.join(d, '') for d in self.dirs]
+        
+        # Labels as a compact int8 array; samples return numpy scalars that collate to an int8 tensor
+        self.label_array = self.index[:, 2].astype(np.int8)
+        
+        # The batched decoder only handles JPEGs, so reject other frame formats up front
+        if return_bytes:
+            for dir_id, names in enumerate(self.frames):
+                non_jpeg = [name for name in names if not name.lower().endswith(('.jpg', '.jpeg'))]
+                if non_jpeg:
+                    raise ValueError(f"return_bytes requires JPEG frames, but {self.dirs[dir_id]} contains {non_jpeg[0]}.")
+
+    def _build_index(self, sequence_dirs):
+        """
+        Scan sequence directories once and build the window index.
+
+        Args:
+            sequence_dirs (list): (sequence_dir, label) pairs
+        """
+        self.dirs = []    # Sequence directories, stored once
+        self.frames = []  # Sorted image filenames per directory
+        rows = []         # [dir_id, start_frame, label] blocks, one per directory
+        
+        # Listing directories is latency-bound I/O that releases the GIL, so scan them concurrently
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            listings = list(executor.map(self._scan_sequence_dir, [d for d, _ in sequence_dirs]))
+        
+        for (sequence_dir, label), images in zip(sequence_dirs, listings):
+            dir_id = len(self.dirs)
+            self.dirs.append(sequence_dir)
+            self.frames.append(np.array(images, dtype=object))
             
-            # Process each sequence directory
-            for sequence in os.listdir(label_dir):
-                sequence_dir = os.path.join(label_dir, sequence)
-                # Get sorted list of valid image files
-                images = sorted([
-                    img for img in os.listdir(sequence_dir)
-                    if img.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff'))
-                ])
-                
-                # Apply max_length if specified
-                if self.max_length is not None:
-                    images = images[:self.max_length]  # NEW: Limit the number of images per sequence
+            # Create overlapping sequences with stride (incomplete windows are padded on load)
+            starts = np.arange(0, len(images), self.stride, dtype=np.int32)
+            block = np.empty((len(starts), 3), dtype=np.int32)
+            block[:, 0] = dir_id
+            block[:, 1] = starts
+            block[:, 2] = label
+            rows.append(block)
+        
+        self.index = np.concatenate(rows) if rows else np.empty((0, 3), dtype=np.int32)
 
-                # Create overlapping sequences with stride
-                for i in range(0, len(images), self.stride):
-                    seq = images[i:i + self.seq_len]
-                    if len(seq) == self.seq_len:
-                        # Store complete sequences
-                        self.sequences.append([os.path.join(sequence_dir, img) for img in seq])
-                        self.labels.append(1 if label == 'pos' else 0)
-                    else:
-                        # Pad incomplete sequences
-                        padded_seq = seq + [None] * (self.seq_len - len(seq))
-                        self.sequences.append([os.path.join(sequence_dir, img) if img is not None else None for img in padded_seq])
-                        self.labels.append(1 if label == 'pos' else 0)
+    def _scan_sequence_dir(self, sequence_dir):
+        """
+        List the image files of one sequence directory.
+        
+        Args:
+            sequence_dir (str): Sequence directory to scan
+        
+        Returns:
+            list: Sorted image filenames, truncated to max_length if set
+        """
+        with os.scandir(sequence_dir) as entries:
+            images = sorted([
+                entry.name for entry in entries
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS)
+            ])
+        
+        # Apply max_length if specified
+        if self.max_length is not None:
+            images = images[:self.max_length]  # NEW: Limit the number of images per sequence
+        return images
+
+    def _index_signature(self, split_dir, sequence_dirs):
+        """
+        Build the cache key: scan parameters plus the mtimes of every directory whose listing
+        the index depends on (adding/removing frames changes the sequence directory's mtime).
+        """
+        dirs = [split_dir] + [os.path.join(split_dir, label) for label in ['pos', 'neg']]
+        dirs = [d for d in dirs if os.path.exists(d)] + [d for d, _ in sequence_dirs]
+        mtimes = tuple((d, os.stat(d).st_mtime_ns) for d in dirs)
+        return (os.path.abspath(split_dir), self.seq_len, self.stride, self.max_length, mtimes)
+
+    def _index_cache_path(self, split_dir):
+        """Return the index cache file path for this split, or None if caching is disabled."""
+        if self.index_cache_dir is None:
+            return None
+        key = f"{os.path.abspath(split_dir)}|{self.seq_len}|{self.stride}|{self.max_length}"
+        name = f"{self.split}_index_{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}.pkl"
+        return os.path.join(self.index_cache_dir, name)
+
+    def _load_index_cache(self, cache_path, signature):
+        """Load (dirs, frames, index) from the cache if it exists and matches the signature."""
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read index cache {cache_path}: {e}")
+            return None
+        if cached.get('signature') != signature:
+            return None
+        return cached['dirs'], cached['frames'], cached['index']
+
+    def _save_index_cache(self, cache_path, signature):
+        """Write the index to the cache atomically (no partially written files for other workers)."""
+        if cache_path is None:
+            return
+        os.makedirs(self.index_cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'signature': signature, 'dirs': self.dirs, 'frames': self.frames, 'index': self.index}, f)
+        os.replace(tmp_path, cache_path)
+
+    def _load_image(self, img_path):
+        """
+        Decode a frame as an RGB PIL image.
+
+        JPEGs are decoded straight to RGB with libjpeg-turbo when PyTurboJPEG is installed;
+        other files go through PIL and are only converted when not already RGB. When
+        decode_size is set, both decoders decode JPEGs at the same reduced DCT scale.
+
+        Args:
+            img_path (str): Path to the image file
+
+        Returns:
+            PIL.Image.Image: Decoded RGB image
+        """
+        if _TURBO_JPEG is not None and img_path.lower().endswith(('.jpg', '.jpeg')):
+            return Image.fromarray(self._decode_turbo(img_path))
+        
+        image = Image.open(img_path)
+        if self.decode_size is not None:
+            # Only affects JPEGs; other formats ignore the draft request
+            image.draft('RGB', (self.decode_size, self.decode_size))
+        if image.mode != 'RGB':
+            return image.convert('RGB')
+        image.load()  # Decode now so errors surface here and the file is closed
+        return image
+
+    def _load_array(self, img_path):
+        """
+        Decode a frame as an RGB uint8 array of shape [H, W, 3].
+
+        Args:
+            img_path (str): Path to the image file
+
+        Returns:
+            np.ndarray: Decoded RGB frame
+        """
+        if _TURBO_JPEG is not None and img_path.lower().endswith(('.jpg', '.jpeg')):
+            return self._decode_turbo(img_path)
+        return np.asarray(self._load_image(img_path))
+
+    def _decode_turbo(self, img_path):
+        """
+        Decode a JPEG to an RGB uint8 array with libjpeg-turbo, reduced like Image.draft when
+        decode_size is set.
+
+        Args:
+            img_path (str): Path to the JPEG file
+
+        Returns:
+            np.ndarray: Decoded RGB frame [H, W, 3]
+        """
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        scaling_factor = None
+        if self.decode_size is not None:
+            width, height = _TURBO_JPEG.decode_header(data)[:2]
+            # Same rule as PIL's Image.draft: the largest denominator dividing into each side // decode_size
+            for denom in (8, 4, 2):
+                if min(width // self.decode_size, height // self.decode_size) >= denom:
+                    scaling_factor = (1, denom)
+                    break
+        return _TURBO_JPEG.decode(data, pixel_format=TJPF_RGB, scaling_factor=scaling_factor)
+
+    def _decode_frames(self, sequence, loader):
+        """
+        Decode the frames of a sequence in parallel on the decode thread pool.
+
+        Args:
+            sequence (list): Frame paths, None for padding
+            loader (callable): Decodes a single path
+
+        Returns:
+            list: Decoded frames in order, None for padded or unreadable frames
+        """
+        def decode(img_path):
+            if img_path is None:
+                return None
+            try:
+                return loader(img_path)
+            except Exception as e:
+                print(f"Error loading image {img_path}: {e}")
+                return None
+        
+        return list(_get_decode_pool().map(decode, sequence))
+
+    def _load_sequence_arrays(self, sequence):
+        """
+        Load a sequence of frames as one stacked uint8 array, using the decoded-sequence cache
+        when cache_dir is set.
+
+        Padded and unreadable frames are zero frames shaped like the valid frames (or
+        default_img_size if there are none), so the sequence can be stacked before resizing.
+
+        Args:
+            sequence (list): Frame paths, None for padding
+
+        Returns:
+            tuple: (frames [seq_len, H, W, 3] uint8 array, mask [seq_len] bool array)
+        """
+        cache_path = None
+        if self.cache_dir is not None:
+            key = ','.join(img_path or '' for img_path in sequence)
+            if self.decode_size is not None:
+                key = f"{self.decode_size}:{key}"  # Reduced-scale decodes are cached separately
+            cache_path = os.path.join(self.cache_dir, f"{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}.npy")
+            if os.path.exists(cache_path):
+                try:
+                    # Memory-mapped read served from the page cache; copy so the result is writable
+                    frames = np.array(np.load(cache_path, mmap_mode='r'))
+                    return frames, np.array([img_path is not None for img_path in sequence])
+                except Exception as e:
+                    print(f"Warning: Could not read cached sequence {cache_path}: {e}")
+        
+        frames = self._decode_frames(sequence, self._load_array)
+        mask = np.array([frame is not None for frame in frames])
+        shape = next((frame.shape for frame in frames if frame is not None), (self.default_size, self.default_size, 3))
+        dummy_frame = np.zeros(shape, dtype=np.uint8)
+        frames = np.stack([frame if frame is not None else dummy_frame for frame in frames])
+        
+        # Only cache sequences whose frames all decoded, so a cached mask is just the padding
+        if cache_path is not None and all(m == (p is not None) for m, p in zip(mask, sequence)):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, frames)
+            os.replace(tmp_path, cache_path)
+        return frames, mask
+
+    def _load_sequence_tensor(self, sequence):
+        """
+        Load a sequence of frames into a single uint8 tensor for batched v2 transforms.
+
+        Args:
+            sequence (list): Frame paths, None for padding
+
+        Returns:
+            tuple: (images [seq_len, 3, H, W] uint8 tensor, mask [seq_len] bool tensor)
+        """
+        frames, mask = self._load_sequence_arrays(sequence)
+        images = torch.from_numpy(frames).permute(0, 3, 1, 2)  # [seq_len, 3, H, W]
+        return images, torch.from_numpy(mask)
+
+    @property
+    def labels(self):
+        """Labels of all sequences (1 = drowsy, 0 = alert) as an int8 array."""
+        return self.label_array
+
+    def __getstate__(self):
+        """Drop the scripted transform when pickling; each worker scripts it again on first use."""
+        state = self.__dict__.copy()
+        state['_scripted_transform'] = None
+        return state
+
+    def _get_batched_transform(self):
+        """
+        Return the transform for stacked sequences, scripting it on first use if requested.
+        
+        Returns:
+            callable: The scripted nn.Sequential, or the eager transform if scripting is off or failed
+        """
+        if not self.script_transform:
+            return self.transform
+        if self._scripted_transform is None:
+            try:
+                self._scripted_transform = torch.jit.script(nn.Sequential(*self.transform.transforms))
+            except Exception as e:
+                warnings.warn(f"Could not script transform, using it unscripted: {e}")
+                self.script_transform = False
+                return self.transform
+        return self._scripted_transform
 
     def __len__(self):
         """Return total number of sequences in the dataset."""
-        return len(self.sequences)
+        return len(self.index)
+
+    def _get_pad_tensor(self):
+        """
+        Return the transformed padding frame, building it on first use.
+        
+        Padding frames are masked out downstream, so a single transformed black image is
+        reused for every pad slot instead of allocating and transforming a fresh one each time.
+        """
+        if self._pad_tensor is None:
+            self._pad_tensor = self.transform(Image.new('RGB', (self.default_size, self.default_size), color=0))
+        return self._pad_tensor
+
+    def _to_memory_format(self, images):
+        """Return images in channels_last layout if requested (a no-op for raw NHWC-decoded frames)."""
+        if self.channels_last:
+            return images.contiguous(memory_format=torch.channels_last)
+        return images
+
+    def _make_sample(self, images, mask, valid_len, label):
+        """Assemble the returned sample in the configured layout and mask format."""
+        images = self._to_memory_format(images)
+        if self.return_valid_len:
+            return images, valid_len, label
+        return images, mask, label
 
     def _validate_transformed_data(self, images):
         """
@@ -109,7 +538,8 @@ class DriverDrowsinessDataset(Dataset):
         Get a sequence of images and corresponding label.
         
         For training split, applies synchronized transformations across
-        all frames in the sequence using index-based seeding.
+        all frames in the sequence: ``transforms.v2`` pipelines are called once on the
+        stacked sequence, other transforms replay the same torch RNG state per frame.
 
         Args:
             idx (int): Index of sequence to retrieve
@@ -118,53 +548,79 @@ class DriverDrowsinessDataset(Dataset):
             tuple: Contains:
                 - images (torch.Tensor): Image sequence tensor [seq_len, C, H, W]
                 - mask (torch.Tensor): Boolean mask for valid frames [seq_len]
-                - label (int): Sequence label (0 or 1)
+                - label (np.int8): Sequence label (0 or 1)
         """
-        sequence = self.sequences[idx]
-        label = self.labels[idx]
-        images = []
-        mask = []
+        dir_id, start = self.index[idx, :2]
+        label = self.label_array[idx]
         
-        # Load images and create validity mask
-        for img_path in sequence:
-            if img_path is not None:
-                try:
-                    image = Image.open(img_path).convert('RGB')
-                    images.append(image)
-                    mask.append(1)
-                except Exception as e:
-                    print(f"Error loading image {img_path}: {e}")
-                    dummy_image = Image.new('RGB', (self.default_size, self.default_size), color=0)
-                    images.append(dummy_image)
-                    mask.append(0)
-            else:
-                dummy_image = Image.new('RGB', (self.default_size, self.default_size), color=0)
-                images.append(dummy_image)
-                mask.append(0)
-
-        # Apply transformations
-        if self.transform and self.split == 'train':
-            # Synchronize transformations across sequence
+        # Join paths only for the frames in this window and pad the rest
+        prefix = self.dir_prefixes[dir_id]
+        files = self.frames[dir_id][start:start + self.seq_len]
+        sequence = [prefix + f for f in files] + [None] * (self.seq_len - len(files))
+        
+        if self.return_bytes:
+            # Encoded files only; decoding is deferred to the batch collate
+            data = [read_file(prefix + f) for f in files]
+            mask = torch.arange(self.seq_len) < len(files)
+            return data, mask, label
+        
+        if self.gpu_transform:
+            # Raw uint8 frames; resizing and normalization happen on the device after collation
+            images, mask = self._load_sequence_tensor(sequence)
+            return self._make_sample(images, mask, len(files), label)
+        
+        if self.transform is None:
+            # Without a transform, convert the stacked uint8 decode output straight to [0, 1]
+            # floats (same result as ToTensor) in one pass instead of per-frame PIL conversions
+            images, mask = self._load_sequence_tensor(sequence)
+            memory_format = torch.channels_last if self.channels_last else torch.contiguous_format
+            images = images.to(torch.float32, memory_format=memory_format).div_(255)
+            if self.validate:
+                self._validate_transformed_data(images)
+            return self._make_sample(images, mask, len(files), label)
+        
+        if self.batched_transform:
+            # Tensor-native transforms run once over the whole sequence; v2 samples random
+            # parameters once per call, so all frames get the same augmentation
+            images, mask = self._load_sequence_tensor(sequence)
+            images = self._get_batched_transform()(images)
+            if self.validate:
+                self._validate_transformed_data(images)
+            return self._make_sample(images, mask, len(files), label)
+        
+        # Load images
+        if self.cache_dir is not None:
+            frames, valid = self._load_sequence_arrays(sequence)
+            decoded = [Image.fromarray(frame) if v else None for frame, v in zip(frames, valid)]
+        else:
+            decoded = self._decode_frames(sequence, self._load_image)
+        
+        # Synchronize training transformations across the sequence by replaying the same
+        # RNG state for every frame (the first frame already starts from it)
+        sync_rng = self.split == 'train'
+        if sync_rng:
             random_state = torch.get_rng_state()
-            torch.manual_seed(idx)
-            
-            transformed_images = []
-            for image in images:
-                torch.set_rng_state(random_state)  # Use same random state for each frame
-                transformed_images.append(self.transform(image))
+        
+        # Transform each frame straight into preallocated output tensors (no stacking)
+        images = None
+        mask = torch.zeros(self.seq_len, dtype=torch.bool)
+        for i, image in enumerate(decoded):
+            if image is None:
+                frame = self._get_pad_tensor()
+            else:
+                mask[i] = True
+                if sync_rng and i > 0:
+                    torch.set_rng_state(random_state)  # Use same random state for each frame
+                frame = self.transform(image)
             
-            images = transformed_images
-        elif self.transform:
-            images = [self.transform(image) for image in images]
-        else:
-            to_tensor = transforms.ToTensor()
-            images = [to_tensor(image) for image in images]
-
-        # Stack and validate images
-        images = torch.stack(images)
-        self._validate_transformed_data(images)
-        mask = torch.tensor(mask, dtype=torch.bool)
-        return images, mask, label
+            if images is None:
+                images = frame.new_empty((self.seq_len,) + tuple(frame.shape))
+            images[i].copy_(frame)
+
+        # Validate images
+        if self.validate:
+            self._validate_transformed_data(images)
+        return self._make_sample(images, mask, len(files), label)
     
 class DriverDrowsinessDatasetv2(Dataset):
     """
@@ -612,6 +1068,261 @@ class DriverDrowsinessDatasetv3(Dataset):
         mask = torch.tensor(mask, dtype=torch.bool)
         return images, mask, label
 
+class DriverDrowsinessWebDataset(IterableDataset):
+    """
+    Streaming variant of DriverDrowsinessDataset reading WebDataset tar shards.
+
+    Each shard sample holds all frames of one sequence directory (written by
+    write_webdataset_shards), so a sequence is read as one contiguous chunk of a tar file
+    instead of seq_len small random reads. Windows, padding and masks are produced exactly
+    as in DriverDrowsinessDataset. Shards are split across DataLoader workers; use
+    ``shuffle`` instead of the DataLoader's shuffle option.
+    """
+
+    def __init__(self, urls, split='train', transform=None, seq_len=16, stride=None, default_img_size=224, shuffle=0):
+        """
+        Initialize the streaming dataset.
+
+        Args:
+            urls (str or list): Shard path(s) or brace pattern, e.g. 'shards/train-{000000..000009}.tar'
+            split (str): Dataset split ('train', 'val', 'test'); training synchronizes per-frame transforms
+            transform (callable): Optional transforms; ``transforms.v2`` transforms are applied once per
+                                  sequence, others per PIL frame as in DriverDrowsinessDataset
+            seq_len (int): Length of image sequences
+            stride (int, optional): Stride for creating overlapping sequences
+            default_img_size (int): Size for dummy images when padding
+            shuffle (int): Size of the sample shuffle buffer (0 disables shuffling)
+        """
+        if wds is None:
+            raise ImportError("DriverDrowsinessWebDataset requires the 'webdataset' package.")
+        
+        self.split = split
+        self.transform = transform
+        self.seq_len = seq_len
+        self.stride = stride if stride is not None else seq_len // 2
+        self.default_size = default_img_size
+        
+        self.pipeline = wds.WebDataset(urls, shardshuffle=shuffle > 0)
+        if shuffle > 0:
+            self.pipeline = self.pipeline.shuffle(shuffle)
+
+    def _decode(self, data):
+        """Decode encoded frame bytes to an RGB uint8 array [H, W, 3]."""
+        if _TURBO_JPEG is not None and data[:2] == b'\xff\xd8':
+            return _TURBO_JPEG.decode(data, pixel_format=TJPF_RGB)
+        image = Image.open(io.BytesIO(data))
+        return np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+
+    def _make_window(self, frames, label):
+        """Pad, transform and stack one window of decoded frames."""
+        mask = torch.zeros(self.seq_len, dtype=torch.bool)
+        mask[:len(frames)] = True
+        shape = frames[0].shape if frames else (self.default_size, self.default_size, 3)
+        frames = frames + [np.zeros(shape, dtype=np.uint8)] * (self.seq_len - len(frames))
+        images = torch.from_numpy(np.stack(frames)).permute(0, 3, 1, 2)  # [seq_len, 3, H, W] uint8
+        
+        if self.transform is None:
+            images = images.to(torch.float32, memory_format=torch.contiguous_format).div_(255)
+        elif isinstance(self.transform, v2.Transform):
+            images = self.transform(images)
+        else:
+            # PIL transforms, synchronized across frames by replaying the RNG state
+            random_state = torch.get_rng_state()
+            transformed = []
+            for i, frame in enumerate(images.permute(0, 2, 3, 1).numpy()):
+                if self.split == 'train' and i > 0:
+                    torch.set_rng_state(random_state)
+                transformed.append(self.transform(Image.fromarray(frame)))
+            images = torch.stack(transformed)
+        return images, mask, label
+
+    def __iter__(self):
+        """Yield (images, mask, label) windows from the shards."""
+        for sample in self.pipeline:
+            # int8 labels, collating to the same dtype as DriverDrowsinessDataset
+            label = np.int8(int(sample['cls']))
+            frame_keys = sorted(key for key in sample if key.lower().endswith(IMAGE_EXTENSIONS))
+            frames = [self._decode(sample[key]) for key in frame_keys]
+            for i in range(0, len(frames), self.stride):
+                yield self._make_window(frames[i:i + self.seq_len], label)
+
+def write_webdataset_shards(dataset, pattern, maxcount=100):
+    """
+    Pack a folder-based DriverDrowsinessDataset into WebDataset tar shards.
+
+    Writes one sample per sequence directory containing its original encoded frames
+    (no re-encoding) as ``<frame_idx>.<ext>`` entries plus the ``cls`` label. Frames
+    shared by overlapping windows are stored once.
+
+    Args:
+        dataset (DriverDrowsinessDataset): Source dataset (its max_length limit is respected)
+        pattern (str): Output shard pattern, e.g. 'shards/train-%06d.tar'
+        maxcount (int): Maximum number of sequences per shard
+    """
+    if wds is None:
+        raise ImportError("write_webdataset_shards requires the 'webdataset' package.")
+    
+    os.makedirs(os.path.dirname(pattern) or '.', exist_ok=True)
+    dir_labels = np.zeros(len(dataset.dirs), dtype=np.int8)
+    dir_labels[dataset.index[:, 0]] = dataset.labels
+    
+    with wds.ShardWriter(pattern, maxcount=maxcount) as sink:
+        for dir_id, sequence_dir in enumerate(dataset.dirs):
+            if len(dataset.frames[dir_id]) == 0:
+                continue
+            sample = {'__key__': f"{dir_id:08d}", 'cls': int(dir_labels[dir_id])}
+            for i, name in enumerate(dataset.frames[dir_id]):
+                ext = os.path.splitext(name)[1].lower()
+                with open(os.path.join(sequence_dir, name), 'rb') as f:
+                    sample[f"{i:05d}{ext}"] = f.read()
+            sink.write(sample)
+
+def collate_channels_last(batch):
+    """
+    Collates (images, mask, label) samples while keeping channels_last frames in NHWC order.
+
+    The default collate_fn stacks into a contiguous [B, T, C, H, W] tensor, discarding the
+    per-sample layout. This stacks the NHWC views instead, so ``images.flatten(0, 1)`` in
+    the model is already a channels_last [B*T, C, H, W] tensor with no copy.
+
+    Args:
+        batch (list): Samples from DriverDrowsinessDataset(channels_last=True)
+
+    Returns:
+        tuple: (images [B, T, C, H, W], masks [B, T], labels [B])
+    """
+    images, masks, labels = zip(*batch)
+    return _stack_channels_last(images), torch.stack(masks), torch.from_numpy(np.asarray(labels))
+
+def _stack_channels_last(images):
+    """Stack [T, C, H, W] channels_last sequences into [B, T, C, H, W] with NHWC storage."""
+    return torch.stack([image.permute(0, 2, 3, 1) for image in images]).permute(0, 1, 4, 2, 3)
+
+def collate_valid_len(batch):
+    """
+    Collates (images, valid_len, label) samples and rebuilds the [B, T] frame mask once per batch.
+
+    Args:
+        batch (list): Samples from DriverDrowsinessDataset(return_valid_len=True)
+
+    Returns:
+        tuple: (images [B, T, C, H, W], masks [B, T] bool, labels [B])
+    """
+    images, valid_lens, labels = zip(*batch)
+    if images[0].is_contiguous(memory_format=torch.channels_last) and not images[0].is_contiguous():
+        images = _stack_channels_last(images)
+    else:
+        images = torch.stack(images)
+    masks = torch.arange(images.size(1)) < torch.tensor(valid_lens).unsqueeze(1)
+    return images, masks, torch.from_numpy(np.asarray(labels))
+
+class JPEGBatchDecoder:
+    """
+    Collate function that decodes a whole batch of encoded JPEG frames in one call.
+
+    Pairs with ``DriverDrowsinessDataset(return_bytes=True)``. All B*T frames of the batch
+    go through a single batched ``torchvision.io.decode_jpeg`` call (nvJPEG when ``device``
+    is CUDA), then are resized and normalized with gpu_preprocess and scattered into a
+    zero-padded [B, T, 3, size, size] batch.
+
+    If the batched call fails (e.g. a truncated or corrupt file), the frames are decoded one by
+    one instead and any frame that still fails is logged and masked out, as the per-sample
+    loaders do.
+
+    CUDA decoding cannot run inside DataLoader worker processes, so use ``num_workers=0``
+    with ``device='cuda'``; with workers, keep the default CPU device.
+    """
+
+    def __init__(self, device='cpu', size=224, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        """
+        Args:
+            device (str or torch.device): Device to decode and preprocess on
+            size (int): Output height and width
+            mean (tuple): Per-channel normalization mean
+            std (tuple): Per-channel normalization standard deviation
+        """
+        self.device = torch.device(device)
+        self.size = size
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, batch):
+        """
+        Args:
+            batch (list): (frame_bytes, mask, label) samples
+
+        Returns:
+            tuple: (images [B, T, 3, size, size], masks [B, T] bool, labels [B])
+        """
+        data, masks, labels = zip(*batch)
+        masks = torch.stack(masks)
+        labels = torch.from_numpy(np.asarray(labels))
+        flat = [frame for frames in data for frame in frames]
+        try:
+            decoded = decode_jpeg(flat, mode=ImageReadMode.RGB, device=self.device)
+        except RuntimeError:
+            decoded = self._decode_each(flat, masks)
+        
+        if not decoded:
+            images = torch.zeros(masks.shape + (3, self.size, self.size), device=self.device)
+            return images, masks, labels
+        
+        # Valid frames are a prefix of each window, so row-major mask order matches the flat list
+        if all(frame.shape == decoded[0].shape for frame in decoded):
+            frames = gpu_preprocess(torch.stack(decoded).unsqueeze(0), self.size, self.mean, self.std)[0]
+        else:
+            frames = torch.cat([
+                gpu_preprocess(frame[None, None], self.size, self.mean, self.std)[0] for frame in decoded
+            ])
+        images = frames.new_zeros(masks.shape + frames.shape[1:])
+        images[masks.to(self.device)] = frames
+        return images, masks, labels
+
+    def _decode_each(self, flat, masks):
+        """
+        Decode frames one at a time, masking out any that fail.
+
+        Args:
+            flat (list): Encoded frames of the batch in row-major mask order
+            masks (torch.Tensor): [B, T] bool mask, updated in place for failed frames
+
+        Returns:
+            list: Decoded [3, H, W] uint8 frames that succeeded, in order
+        """
+        decoded = []
+        for (b, t), data in zip(masks.nonzero().tolist(), flat):
+            try:
+                decoded.append(decode_jpeg(data, mode=ImageReadMode.RGB, device=self.device))
+            except RuntimeError as e:
+                print(f"Error decoding frame {t} of batch sample {b}: {e}")
+                masks[b, t] = False
+        return decoded
+
+def gpu_preprocess(images, size=224, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+    """
+    Resizes and normalizes a batch of raw uint8 sequences on their current device.
+
+    Intended for datasets created with ``gpu_transform=True``: move the collated batch to the
+    GPU with ``non_blocking=True`` (and ``pin_memory=True`` in the DataLoader), then call this.
+
+    Args:
+        images (torch.Tensor): uint8 frames [batch_size, seq_len, 3, H, W]
+        size (int): Output height and width
+        mean (tuple): Per-channel normalization mean
+        std (tuple): Per-channel normalization standard deviation
+
+    Returns:
+        torch.Tensor: Normalized float frames [batch_size, seq_len, 3, size, size]
+    """
+    batch_size, seq_len = images.shape[:2]
+    x = images.flatten(0, 1).float().div_(255)
+    if x.shape[-2:] != (size, size):
+        x = F.interpolate(x, size=(size, size), mode='bilinear', align_corners=False, antialias=True)
+    mean = torch.tensor(mean, device=x.device).view(1, 3, 1, 1)
+    std = torch.tensor(std, device=x.device).view(1, 3, 1, 1)
+    x = x.sub_(mean).div_(std)
+    return x.unflatten(0, (batch_size, seq_len))
+
 def visualize_sequence(dataset, idx, rows=2):
     """
     Visualizes a sequence of images from the dataset with their masks.
@@ -624,18 +1335,15 @@ def visualize_sequence(dataset, idx, rows=2):
     images, mask, label = dataset[idx]
     cols = dataset.seq_len // rows
     
-    # Convert tensors back to displayable format
+    # Convert tensors back to displayable format: denormalize and convert to NHWC once
     if isinstance(images, torch.Tensor):
-        denorm = transforms.Normalize(
-            mean=[-m/s for m, s in zip([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])],
-            std=[1/s for s in [0.229, 0.224, 0.225]]
-        )
-        images = denorm(images).clip(0, 1)
+        images = images.detach().cpu().mul(_STD).add_(_MEAN).clamp_(0, 1)
+        images = images.permute(0, 2, 3, 1).numpy()
     
     plt.figure(figsize=(20, 8))
     for i in range(dataset.seq_len):
         plt.subplot(rows, cols, i + 1)
-        plt.imshow(images[i].permute(1, 2, 0))
+        plt.imshow(images[i])
         border_color = 'green' if mask[i] else 'red'
         plt.gca().spines['bottom'].set_color(border_color)
         plt.gca().spines['top'].set_color(border_color)